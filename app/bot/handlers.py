@@ -1,12 +1,44 @@
-from telegram import Update
+from telegram import Message, Update
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import ContextTypes
+from typing import Dict, Optional
+import asyncio
 import logging
+import re
+from ..services.gemini import get_gemini_service
 
 logger = logging.getLogger(__name__)
 
+# Messages answered without retrieval or generation
+SMALL_TALK = frozenset({
+    "привет", "здравствуйте", "добрый день", "добрый вечер", "доброе утро", "hi", "hello",
+    "спасибо", "спасибо большое", "благодарю", "thanks", "thank you",
+    "ок", "ok", "окей", "хорошо", "понятно", "ясно", "пока", "до свидания"
+})
+MIN_QUESTION_LENGTH = 2  # Characters; short abbreviations like "ИП" still count
+WORD_RE = re.compile(r"\w+")
+SMALL_TALK_ANSWER = "Задайте, пожалуйста, вопрос о налоговом законодательстве Грузии — я постараюсь помочь."
+
 class BotHandlers:
-    def __init__(self, gemini_service):
-        self.gemini = gemini_service
+    def __init__(self, gemini_service=None):
+        # Reuse the shared service so handlers never re-initialize SDK clients
+        self.gemini = gemini_service or get_gemini_service()
+        # Strong references to fire-and-forget tasks so they aren't garbage collected
+        self._background_tasks = set()
+        # Per-chat FIFO queues, each drained by its own worker task
+        self._chat_queues: Dict[int, asyncio.Queue] = {}
+        self._chat_workers: Dict[int, asyncio.Task] = {}
+
+    def _fire_and_forget(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_background_task_done)
+
+    def _on_background_task_done(self, task: asyncio.Task) -> None:
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.warning(f"Background task failed: {str(task.exception())}")
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
@@ -15,18 +47,130 @@ class BotHandlers:
         )
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Queue the message for its chat and return immediately.
+
+        Messages from one chat are answered in order; different chats are answered concurrently.
+        """
+        chat_id = update.effective_chat.id
+        queue = self._chat_queues.get(chat_id)
+        if queue is None:
+            queue = self._chat_queues[chat_id] = asyncio.Queue()
+        queue.put_nowait((update, context))
+
+        if chat_id not in self._chat_workers:
+            self._chat_workers[chat_id] = asyncio.create_task(self._chat_worker(chat_id))
+
+    async def _chat_worker(self, chat_id: int):
+        queue = self._chat_queues[chat_id]
+        try:
+            while not queue.empty():
+                update, context = queue.get_nowait()
+                try:
+                    await self._answer_message(update, context)
+                except Exception as e:
+                    logger.error(f"Error answering message in chat {chat_id}: {str(e)}")
+        finally:
+            # Nothing is awaited between the empty check and cleanup, so no message can be lost
+            del self._chat_workers[chat_id]
+            del self._chat_queues[chat_id]
+
+    async def drain(self, timeout: float) -> None:
+        """
+        Wait for every queued message to be answered, for at most timeout seconds.
+
+        Called on shutdown; messages still queued when the timeout expires are lost.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        # Workers may start while we wait, so re-check until none are left
+        while self._chat_workers:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            await asyncio.wait(list(self._chat_workers.values()), timeout=remaining)
+
+        if self._chat_workers:
+            queued = sum(queue.qsize() for queue in self._chat_queues.values())
+            logger.warning(
+                f"Shutdown timed out answering {len(self._chat_workers)} chats, "
+                f"{queued} queued messages dropped"
+            )
+
+    async def _answer_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             user_id = update.effective_user.id
             question = update.message.text
             logger.info(f"Received question from user {user_id}: {question}")
 
-            await update.message.chat.send_action("typing")
-            answer = await self.gemini.ask_legal_question(question)
-            await update.message.reply_text(answer)
+            if self._is_small_talk(question):
+                await update.message.reply_text(SMALL_TALK_ANSWER)
+                return
+
+            # Show the typing indicator without waiting for the round-trip
+            self._fire_and_forget(update.message.chat.send_action("typing"))
+
+            # Show the answer as it is generated by editing a single message
+            sent = None
+
+            async def show_partial(text: str) -> None:
+                nonlocal sent
+                if len(text) > MessageLimit.MAX_TEXT_LENGTH:
+                    return  # Too long to preview; the final answer is sent in parts
+                if sent is None:
+                    sent = await update.message.reply_text(text)
+                else:
+                    sent = await sent.edit_text(text)
+
+            answer = await self.gemini.ask_legal_question(question, on_partial=show_partial)
+            await self._send_answer(update, sent, answer)
             
         except Exception as e:
             logger.error(f"Error handling message: {str(e)}")
             await update.message.reply_text(
                 "Извините, произошла ошибка при обработке вашего вопроса. "
                 "Попробуйте позже или переформулируйте вопрос."
-            )
\ No newline at end of file
+            )
+
+    async def _send_answer(self, update: Update, preview: Optional[Message], answer: str) -> None:
+        """
+        Deliver the final answer, completing the streamed preview when there is one.
+
+        Answers longer than a single message are split; the preview is edited into
+        the first part and only the remaining parts are sent as replies. A failed
+        final edit must not turn an already streamed answer into an error reply,
+        so it is retried once after a flood wait and otherwise sent anew.
+        """
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        parts = [answer[start:start + limit] for start in range(0, len(answer), limit)]
+
+        if preview is not None and parts:
+            if preview.text == parts[0]:
+                parts = parts[1:]
+            else:
+                for attempt in range(2):
+                    try:
+                        await preview.edit_text(parts[0])
+                        parts = parts[1:]
+                        break
+                    except RetryAfter as e:
+                        logger.warning(f"Rate limited finishing streamed answer, retrying in {e.retry_after}s")
+                        await asyncio.sleep(e.retry_after)
+                    except TelegramError as e:
+                        logger.warning(f"Failed to finish streamed answer: {str(e)}")
+                        break
+
+        for part in parts:
+            await update.message.reply_text(part)
+
+    @staticmethod
+    def _is_small_talk(text: str) -> bool:
+        """
+        Whether a message is small talk rather than a question.
+
+        That is a greeting or thanks, or anything shorter than MIN_QUESTION_LENGTH
+        characters once punctuation is stripped.
+        """
+        # Drop punctuation and emoji so "Спасибо!! 🙏" matches "спасибо"
+        normalized = " ".join(WORD_RE.findall(text.lower()))
+        return len(normalized) < MIN_QUESTION_LENGTH or normalized in SMALL_TALK
\ No newline at end of file
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 try:
     from pydantic_settings import BaseSettings
 except ImportError:
@@ -19,10 +21,45 @@ class Settings(BaseSettings):
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 100
     DIMENSION_SIZE: int = 768
+    EMBEDDING_CACHE_SIZE: int = 10000
+    EMBEDDING_CONCURRENCY: int = 8
+    THREAD_POOL_SIZE: int = 16  # workers for blocking SDK calls
+    EMBEDDING_CACHE_TTL: int = 30 * 24 * 3600  # seconds
+    
+    # Answers reused for questions at least this similar to a previous one
+    SEMANTIC_CACHE_SIZE: int = 4096
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+    # Answers to exact repeats are also shared across instances via the persistent cache
+    ANSWER_CACHE_TTL: int = 24 * 3600  # seconds
+    
+    # Retrieved context reused for queries at least this similar to a previous one
+    CONTEXT_CACHE_SIZE: int = 512
+    CONTEXT_CACHE_THRESHOLD: float = 0.97
+    
+    # Persistent embedding cache: Redis when REDIS_URL is set, else a local SQLite file
+    REDIS_URL: str = ""
+    EMBEDDING_CACHE_PATH: str = "/tmp/emb_cache.sqlite"
+    # Snapshot of the SQLite cache in GCS so new revisions start warm; disabled when empty
+    EMBEDDING_CACHE_BUCKET: str = ""
+    EMBEDDING_CACHE_BLOB: str = "emb_cache.sqlite"
+    EMBEDDING_CACHE_SNAPSHOT_INTERVAL: int = 15 * 60  # seconds
     
     CLOUD_RUN_URL: str = "localhost:8080"
+    
+    TELEGRAM_CONNECTION_POOL_SIZE: int = 256
+    TELEGRAM_UPDATES_POOL_SIZE: int = 16
+    TELEGRAM_POOL_TIMEOUT: float = 30.0
+    # Time allowed to answer queued messages on shutdown; Cloud Run kills the
+    # container 10 seconds after SIGTERM
+    SHUTDOWN_DRAIN_TIMEOUT: float = 8.0
 
     class Config:
         env_file = ".env"
+        # Settings are shared process-wide via get_settings(); never mutate them
+        frozen = True
+
+@lru_cache
+def get_settings() -> Settings:
+    return Settings()
 
-settings = Settings()
\ No newline at end of file
+settings = get_settings()
\ No newline at end of file
@@ -0,0 +1,519 @@
+from typing import Iterable, List, Optional, Set, Tuple
+import numpy as np
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+try:
+    from google.cloud import storage
+    from google.api_core.exceptions import NotFound, PreconditionFailed
+except ImportError:
+    storage = None
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    def __init__(self, settings):
+        """
+        Initialize the persistent embedding cache.
+
+        The cache is backed by Redis when REDIS_URL is set, so it is shared across
+        workers and instances. Otherwise it falls back to a local SQLite file at
+        EMBEDDING_CACHE_PATH that survives process restarts. It is disabled when
+        neither backend is available. Redis connects lazily, so open() pings it at
+        startup and switches to SQLite if it cannot be reached.
+
+        When EMBEDDING_CACHE_BUCKET is set, the SQLite file is restored from GCS
+        by open() before the database is opened, and uploaded back by
+        save_snapshot(), so Cloud Run revisions do not start with an empty cache.
+        Until open() completes every lookup misses.
+        """
+        self.ttl = settings.EMBEDDING_CACHE_TTL
+        self.client = None
+        self.db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self.path = settings.EMBEDDING_CACHE_PATH
+        self._bucket = settings.EMBEDDING_CACHE_BUCKET
+        self._blob_name = settings.EMBEDDING_CACHE_BLOB
+        self._blob = None
+        # Generation of the snapshot last seen in GCS; 0 means none existed
+        self._generation: Optional[int] = None
+        # Whether the database changed since the last snapshot upload
+        self._dirty = False
+
+        if settings.REDIS_URL:
+            if aioredis is None:
+                logger.warning("redis package not installed, falling back to local embedding cache")
+            else:
+                try:
+                    # Connects lazily; open() verifies the server and falls back to SQLite
+                    self.client = aioredis.from_url(settings.REDIS_URL, socket_connect_timeout=5)
+                    logger.info("Initialized Redis embedding cache")
+                    return
+                except Exception as e:
+                    logger.error(f"Failed to initialize Redis embedding cache: {str(e)}")
+
+        if not settings.EMBEDDING_CACHE_PATH:
+            logger.info("No persistent embedding cache configured")
+            return
+
+        if self._bucket:
+            # Opened by open() once the snapshot has been downloaded
+            return
+
+        try:
+            self.db = self._open_db(settings.EMBEDDING_CACHE_PATH)
+            logger.info(f"Initialized local embedding cache at {settings.EMBEDDING_CACHE_PATH}")
+        except Exception as e:
+            logger.error(f"Failed to initialize local embedding cache: {str(e)}")
+
+    async def open(self) -> None:
+        """
+        Finish initialization at startup.
+
+        Checks that Redis is reachable, falling back to the local database when it
+        is not, and restores the GCS snapshot, if configured, before opening SQLite.
+        """
+        if self.client:
+            try:
+                await self.client.ping()
+                return
+            except Exception as e:
+                logger.error(f"Redis unreachable, falling back to local embedding cache: {str(e)}")
+                client, self.client = self.client, None
+                try:
+                    await client.close()
+                except Exception:
+                    pass
+
+        if self.db is not None or not self.path:
+            return
+        if self._bucket:
+            await asyncio.to_thread(self._restore_snapshot)
+        try:
+            self.db = await asyncio.to_thread(self._open_db, self.path)
+            logger.info(f"Initialized local embedding cache at {self.path}")
+        except Exception as e:
+            logger.error(f"Failed to initialize local embedding cache: {str(e)}")
+
+    async def save_snapshot(self) -> None:
+        """Upload the local database to GCS if it changed since the last upload."""
+        if self.db is None or self._blob is None or not self._dirty:
+            return
+        await asyncio.to_thread(self._upload_snapshot)
+
+    @property
+    def enabled(self) -> bool:
+        return self.client is not None or self.db is not None
+
+    async def get(self, key: bytes) -> Optional[np.ndarray]:
+        """
+        Look up a single embedding.
+
+        Args:
+            key: Cache key (SHA-256 digest)
+
+        Returns:
+            np.ndarray: Cached float32 embedding or None on miss
+        """
+        return (await self.get_many([key]))[0]
+
+    async def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """
+        Look up several embeddings with a single round-trip.
+
+        Args:
+            keys: Cache keys (SHA-256 digests)
+
+        Returns:
+            List[Optional[np.ndarray]]: Cached float32 embedding per key, None on miss
+        """
+        if not self.enabled or not keys:
+            return [None] * len(keys)
+
+        try:
+            if self.client:
+                values = await self.client.mget([self._redis_key(k) for k in keys])
+            else:
+                values = await asyncio.to_thread(self._db_get_many, keys)
+            return [self._decode(v) if v is not None else None for v in values]
+        except Exception as e:
+            logger.error(f"Error reading embedding cache: {str(e)}")
+            return [None] * len(keys)
+
+    async def set(self, key: bytes, vec: np.ndarray, ttl: Optional[int] = None) -> None:
+        """
+        Store a single embedding.
+
+        Args:
+            key: Cache key (SHA-256 digest)
+            vec: Embedding vector
+            ttl: Expiry in seconds, defaults to EMBEDDING_CACHE_TTL
+        """
+        await self.set_many([(key, vec)], ttl=ttl)
+
+    async def set_many(self, items: List[Tuple[bytes, np.ndarray]], ttl: Optional[int] = None) -> None:
+        """
+        Store several embeddings with a single round-trip.
+
+        Args:
+            items: (key, vector) pairs
+            ttl: Expiry in seconds, defaults to EMBEDDING_CACHE_TTL
+        """
+        if not self.enabled or not items:
+            return
+
+        try:
+            if self.client:
+                pipe = self.client.pipeline(transaction=False)
+                for key, vec in items:
+                    pipe.set(self._redis_key(key), self._encode(vec), ex=ttl or self.ttl)
+                await pipe.execute()
+            else:
+                encoded = [(key, self._encode(vec)) for key, vec in items]
+                await asyncio.to_thread(self._db_set_many, encoded, ttl or self.ttl)
+        except Exception as e:
+            logger.error(f"Error writing embedding cache: {str(e)}")
+
+    async def get_recent(self, limit: int) -> List[Tuple[bytes, np.ndarray]]:
+        """
+        Get the most recently stored embeddings, to warm an in-process cache.
+
+        Only the local SQLite cache supports this; Redis is shared and already
+        warm, so it returns nothing there.
+
+        Args:
+            limit: Maximum number of entries
+
+        Returns:
+            List[Tuple[bytes, np.ndarray]]: (key, float32 embedding) pairs, oldest first
+        """
+        if self.db is None or limit <= 0:
+            return []
+
+        try:
+            rows = await asyncio.to_thread(self._db_get_recent, limit)
+            return [(key, self._decode(raw)) for key, raw in rows]
+        except Exception as e:
+            logger.error(f"Error reading recent embeddings: {str(e)}")
+            return []
+
+    async def get_answer(self, key: bytes) -> Optional[str]:
+        """
+        Look up a generated answer.
+
+        Args:
+            key: Cache key (SHA-256 digest of the normalized question and scope)
+
+        Returns:
+            str: Cached answer or None on miss
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            if self.client:
+                value = await self.client.get(f"answer:{key.hex()}")
+                return value.decode() if value is not None else None
+            return await asyncio.to_thread(self._db_get_answer, key)
+        except Exception as e:
+            logger.error(f"Error reading answer cache: {str(e)}")
+            return None
+
+    async def set_answer(self, key: bytes, answer: str, ttl: int) -> None:
+        """
+        Store a generated answer.
+
+        Args:
+            key: Cache key (SHA-256 digest of the normalized question and scope)
+            answer: Answer text
+            ttl: Expiry in seconds
+        """
+        if not self.enabled:
+            return
+
+        try:
+            if self.client:
+                await self.client.set(f"answer:{key.hex()}", answer, ex=ttl)
+            else:
+                await asyncio.to_thread(self._db_set_answer, key, answer, ttl)
+        except Exception as e:
+            logger.error(f"Error writing answer cache: {str(e)}")
+
+    async def get_indexed(self, prefix: str) -> Set[str]:
+        """
+        Get content hashes of chunks already uploaded for a document.
+
+        Args:
+            prefix: Document prefix (country-law_type-language)
+
+        Returns:
+            Set[str]: Chunk hashes, empty when unknown
+        """
+        if not self.enabled:
+            return set()
+
+        try:
+            if self.client:
+                members = await self.client.smembers(f"indexed:{prefix}")
+                return {m.decode() for m in members}
+            return await asyncio.to_thread(self._db_get_indexed, prefix)
+        except Exception as e:
+            logger.error(f"Error reading indexed chunks: {str(e)}")
+            return set()
+
+    async def set_indexed(self, prefix: str, hashes: Set[str]) -> None:
+        """
+        Replace the content hashes of chunks uploaded for a document.
+
+        Args:
+            prefix: Document prefix (country-law_type-language)
+            hashes: Chunk hashes
+        """
+        if not self.enabled:
+            return
+
+        try:
+            if self.client:
+                key = f"indexed:{prefix}"
+                pipe = self.client.pipeline(transaction=True)
+                pipe.delete(key)
+                if hashes:
+                    pipe.sadd(key, *hashes)
+                await pipe.execute()
+            else:
+                await asyncio.to_thread(self._db_set_indexed, prefix, hashes)
+        except Exception as e:
+            logger.error(f"Error writing indexed chunks: {str(e)}")
+
+    async def get_document_hash(self, prefix: str) -> Optional[str]:
+        """
+        Get the content hash of the last fully ingested version of a document.
+
+        Args:
+            prefix: Document prefix (country-law_type-language)
+
+        Returns:
+            str: SHA-256 hex digest, or None when unknown
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            if self.client:
+                value = await self.client.get(f"doc:{prefix}")
+                return value.decode() if value is not None else None
+            return await asyncio.to_thread(self._db_get_document_hash, prefix)
+        except Exception as e:
+            logger.error(f"Error reading document hash: {str(e)}")
+            return None
+
+    async def set_document_hash(self, prefix: str, doc_hash: str) -> None:
+        """
+        Record the content hash of a fully ingested document.
+
+        Args:
+            prefix: Document prefix (country-law_type-language)
+            doc_hash: SHA-256 hex digest of the document content
+        """
+        if not self.enabled:
+            return
+
+        try:
+            if self.client:
+                await self.client.set(f"doc:{prefix}", doc_hash)
+            else:
+                await asyncio.to_thread(self._db_set_document_hash, prefix, doc_hash)
+        except Exception as e:
+            logger.error(f"Error writing document hash: {str(e)}")
+
+    async def close(self) -> None:
+        """Close the underlying Redis connection pool or SQLite database."""
+        if self.client:
+            await self.client.close()
+        if self.db:
+            with self._db_lock:
+                # Closing the last connection folds the WAL back into the main file
+                self.db.close()
+                self.db = None
+
+    def _restore_snapshot(self) -> None:
+        bucket, name = self._bucket, self._blob_name
+        if storage is None:
+            logger.warning("google-cloud-storage not installed, embedding cache snapshot disabled")
+            return
+
+        try:
+            self._blob = storage.Client().bucket(bucket).blob(name)
+            try:
+                self._blob.reload()
+            except NotFound:
+                self._generation = 0
+                logger.info(f"No embedding cache snapshot at gs://{bucket}/{name}")
+                return
+
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Pin the download to the generation we just saw
+            self._blob.download_to_filename(self.path, if_generation_match=self._blob.generation)
+            self._generation = self._blob.generation
+            logger.info(f"Restored embedding cache from gs://{bucket}/{name}")
+        except Exception as e:
+            self._generation = None
+            logger.error(f"Failed to restore embedding cache snapshot: {str(e)}")
+
+    def _upload_snapshot(self) -> None:
+        if self._generation is None:
+            # Never overwrite a snapshot we failed to read
+            return
+
+        snapshot = f"{self.path}.snapshot"
+        try:
+            # Copy a consistent image of the live database, then upload the copy
+            with self._db_lock:
+                self._dirty = False
+                target = sqlite3.connect(snapshot)
+                try:
+                    self.db.backup(target)
+                finally:
+                    target.close()
+
+            # Only replace the generation we last saw, so concurrent revisions
+            # do not clobber each other; the first one to upload wins
+            self._blob.upload_from_filename(snapshot, if_generation_match=self._generation)
+            self._generation = self._blob.generation
+            logger.info(f"Uploaded embedding cache snapshot to gs://{self._blob.bucket.name}/{self._blob.name}")
+        except PreconditionFailed:
+            logger.info("Embedding cache snapshot was replaced by another instance, skipping upload")
+        except Exception as e:
+            self._dirty = True
+            logger.error(f"Failed to upload embedding cache snapshot: {str(e)}")
+        finally:
+            if os.path.exists(snapshot):
+                os.remove(snapshot)
+
+    @staticmethod
+    def _open_db(path: str) -> sqlite3.Connection:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Accessed from worker threads, serialized by _db_lock
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS emb (hash BLOB PRIMARY KEY, vec BLOB NOT NULL, expires INTEGER NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS indexed (prefix TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (prefix, hash))")
+        db.execute("CREATE TABLE IF NOT EXISTS documents (prefix TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS answers (hash BLOB PRIMARY KEY, answer TEXT NOT NULL, expires INTEGER NOT NULL)")
+        # Reads already skip expired rows; purge them so the file (and its GCS snapshot) stays bounded
+        now = int(time.time())
+        db.execute("DELETE FROM emb WHERE expires <= ?", (now,))
+        db.execute("DELETE FROM answers WHERE expires <= ?", (now,))
+        db.commit()
+        return db
+
+    def _db_get_many(self, keys: List[bytes]) -> List[Optional[bytes]]:
+        now = int(time.time())
+        found = {}
+        with self._db_lock:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self.db.execute(
+                    f"SELECT hash, vec FROM emb WHERE expires > ? AND hash IN ({','.join('?' * len(part))})",
+                    [now, *part]
+                )
+                found.update(rows)
+        return [found.get(key) for key in keys]
+
+    def _db_set_many(self, items: Iterable[Tuple[bytes, bytes]], ttl: int) -> None:
+        expires = int(time.time()) + ttl
+        with self._db_lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO emb (hash, vec, expires) VALUES (?, ?, ?)",
+                [(key, raw, expires) for key, raw in items]
+            )
+            self.db.commit()
+            self._dirty = True
+
+    def _db_get_recent(self, limit: int) -> List[Tuple[bytes, bytes]]:
+        with self._db_lock:
+            # Every write gets the same TTL, so the latest expiry is the latest write
+            rows = self.db.execute(
+                "SELECT hash, vec FROM emb WHERE expires > ? ORDER BY expires DESC LIMIT ?",
+                (int(time.time()), limit)
+            ).fetchall()
+        rows.reverse()
+        return rows
+
+    def _db_get_answer(self, key: bytes) -> Optional[str]:
+        with self._db_lock:
+            row = self.db.execute(
+                "SELECT answer FROM answers WHERE hash = ? AND expires > ?",
+                (key, int(time.time()))
+            ).fetchone()
+            return row[0] if row else None
+
+    def _db_set_answer(self, key: bytes, answer: str, ttl: int) -> None:
+        with self._db_lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO answers (hash, answer, expires) VALUES (?, ?, ?)",
+                (key, answer, int(time.time()) + ttl)
+            )
+            self.db.commit()
+            self._dirty = True
+
+    def _db_get_indexed(self, prefix: str) -> Set[str]:
+        with self._db_lock:
+            rows = self.db.execute("SELECT hash FROM indexed WHERE prefix = ?", (prefix,))
+            return {h for (h,) in rows}
+
+    def _db_set_indexed(self, prefix: str, hashes: Set[str]) -> None:
+        with self._db_lock:
+            self.db.execute("DELETE FROM indexed WHERE prefix = ?", (prefix,))
+            self.db.executemany(
+                "INSERT INTO indexed (prefix, hash) VALUES (?, ?)",
+                [(prefix, h) for h in hashes]
+            )
+            self.db.commit()
+            self._dirty = True
+
+    def _db_get_document_hash(self, prefix: str) -> Optional[str]:
+        with self._db_lock:
+            row = self.db.execute("SELECT hash FROM documents WHERE prefix = ?", (prefix,)).fetchone()
+            return row[0] if row else None
+
+    def _db_set_document_hash(self, prefix: str, doc_hash: str) -> None:
+        with self._db_lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO documents (prefix, hash) VALUES (?, ?)",
+                (prefix, doc_hash)
+            )
+            self.db.commit()
+            self._dirty = True
+
+    @staticmethod
+    def _redis_key(key: bytes) -> str:
+        return f"emb8:{key.hex()}"
+
+    @staticmethod
+    def _encode(vec: np.ndarray) -> bytes:
+        # int8 with a per-vector float32 scale: 4 + 768 bytes per embedding
+        vec = np.asarray(vec, dtype=np.float32)
+        scale = float(np.abs(vec).max()) / 127.0 or 1.0
+        q = np.round(vec / scale).astype(np.int8)
+        return np.float32(scale).tobytes() + q.tobytes()
+
+    @staticmethod
+    def _decode(raw: bytes) -> np.ndarray:
+        scale = np.frombuffer(raw[:4], dtype=np.float32)[0]
+        return np.frombuffer(raw[4:], dtype=np.int8).astype(np.float32) * scale
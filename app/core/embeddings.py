@@ -1,25 +1,71 @@
+from google.api_core.exceptions import InvalidArgument, ResourceExhausted
 from google.cloud import aiplatform
+from google.cloud.aiplatform_v1 import IndexServiceClient, RemoveDatapointsRequest
 from vertexai.language_models import TextEmbeddingModel, TextEmbeddingInput
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Set, Tuple
+from collections import OrderedDict
+from functools import lru_cache
 import numpy as np
 import asyncio
+import hashlib
 import logging
+import random
+import tiktoken
 from time import sleep
+from .config import get_settings
+from .embedding_cache import EmbeddingCache
+from .semantic_cache import SemanticCache
 
 logger = logging.getLogger(__name__)
 
+# Vertex AI limits for a single get_embeddings request
+MAX_BATCH_INPUTS = 250
+MAX_BATCH_TOKENS = 20000
+
+# Backoff applied when the embedding API returns ResourceExhausted (429)
+MIN_BACKOFF = 1.0   # seconds
+MAX_BACKOFF = 30.0  # seconds
+MAX_EMBED_RETRIES = 5
+EMBED_JITTER = 0.05  # seconds, max random delay before each concurrent batch
+
+# Datapoints per Vector Search upsert request, and requests in flight
+UPSERT_BATCH_SIZE = 1000
+UPSERT_CONCURRENCY = 4
+
+TOKENIZER_ENCODING = "cl100k_base"
+
+@lru_cache(maxsize=4)
+def _init_vertex(project: str, location: str) -> None:
+    """Initialize Vertex AI once per project/location."""
+    aiplatform.init(project=project, location=location)
+
+@lru_cache(maxsize=4)
+def _get_endpoint(name: str, project: str, location: str) -> aiplatform.MatchingEngineIndexEndpoint:
+    """Construct the Vector Search endpoint once; construction issues a GetIndexEndpoint RPC."""
+    _init_vertex(project, location)
+    return aiplatform.MatchingEngineIndexEndpoint(index_endpoint_name=name)
+
+@lru_cache(maxsize=4)
+def _get_index_client(location: str) -> IndexServiceClient:
+    """Construct the regional IndexServiceClient once; the high-level SDK cannot remove datapoints."""
+    return IndexServiceClient(client_options={"api_endpoint": f"{location}-aiplatform.googleapis.com"})
+
+@lru_cache(maxsize=4)
+def _get_embedding_model(name: str, project: str, location: str) -> TextEmbeddingModel:
+    """Load the embedding model once per model name."""
+    _init_vertex(project, location)
+    return TextEmbeddingModel.from_pretrained(name)
+
 class EmbeddingsManager:
     def __init__(self, settings):
         """Initialize the EmbeddingsManager with configuration settings."""
         self.settings = settings
         
-        # Initialize Vertex AI with project settings
-        aiplatform.init(project=settings.PROJECT_ID, location=settings.LOCATION)
-        
+        # Vertex AI clients are shared across managers; failures are not cached and retry next time
         try:
             logger.info(f"Initializing Vector Search client with endpoint: {settings.VECTOR_SEARCH_ENDPOINT}")
-            self.vector_search_client = aiplatform.MatchingEngineIndexEndpoint(
-                index_endpoint_name=settings.VECTOR_SEARCH_ENDPOINT
+            self.vector_search_client = _get_endpoint(
+                settings.VECTOR_SEARCH_ENDPOINT, settings.PROJECT_ID, settings.LOCATION
             )
         except Exception as e:
             logger.error(f"Failed to initialize Vector Search client: {str(e)}")
@@ -27,12 +73,60 @@ class EmbeddingsManager:
         
         # Initialize the embedding model
         try:
-            self.embedding_model = TextEmbeddingModel.from_pretrained(settings.EMBEDDING_MODEL)
+            self.embedding_model = _get_embedding_model(
+                settings.EMBEDDING_MODEL, settings.PROJECT_ID, settings.LOCATION
+            )
             logger.info(f"Successfully initialized embedding model: {settings.EMBEDDING_MODEL}")
         except Exception as e:
             logger.error(f"Failed to initialize embedding model: {str(e)}")
             self.embedding_model = None
 
+        # Initialize the tokenizer used for chunking. The encoding is baked into the
+        # image (TIKTOKEN_CACHE_DIR); there is deliberately no fallback chunker, since
+        # different chunks get different ids and would duplicate the whole index
+        try:
+            self._tok = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            logger.error(f"Failed to initialize tokenizer, document ingestion disabled: {str(e)}")
+            self._tok = None
+
+        # In-process LRU cache of float16 embeddings keyed by SHA-256 of model/task/title/text
+        self._emb_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._emb_cache_max = settings.EMBEDDING_CACHE_SIZE
+        # User queries (embed_query) served from memory, the persistent cache, or the model;
+        # ingestion, warmup and repeat lookups of the same question are not counted
+        self._cache_stats = {"hits": 0, "persistent_hits": 0, "misses": 0}
+
+        # Whether the index can serve queries: set once a document has been loaded,
+        # or as soon as the index (which outlives the container) is found to hold data
+        self.ready = False
+        # Whether startup ingestion is still running; set by the caller driving it
+        self.loading = False
+
+        # Current embedding backoff in seconds, adapted to ResourceExhausted responses
+        self._backoff = 0.0
+
+        # Content hashes of uploaded chunks per document prefix
+        self._indexed_hashes: Dict[str, Set[str]] = {}
+        # SHA-256 of the content fully ingested per document prefix
+        self._document_hashes: Dict[str, str] = {}
+        # Incremented whenever a load changes the index, so dependent caches can reset
+        self.index_version = 0
+
+        # Retrieved chunks of previous queries per search scope, looked up by similarity
+        self._context_caches: Dict[Tuple[str, str, str, int], SemanticCache] = {}
+        # Retrieved chunks per exact (normalized query, scope), checked before embedding
+        self._context_lru: "OrderedDict[Tuple[str, str, str, str, int], Tuple[str, ...]]" = OrderedDict()
+
+        # Vector Search filter strings per (country, law_type, language)
+        self._filter_cache: Dict[Tuple[str, str, str], str] = {}
+
+        # All-zeros probe used by check_status
+        self._dummy_embedding = [0.0] * settings.DIMENSION_SIZE
+
+        # Persistent cache shared across workers and restarts
+        self.embedding_cache = EmbeddingCache(settings)
+
     async def load_document(self, content: str, country: str, law_type: str, language: str) -> bool:
         """
         Process and load a document into the vector store.
@@ -50,55 +144,129 @@ class EmbeddingsManager:
             logger.error("Embedding model not initialized")
             return False
 
+        # Identifiers and metadata shared by every chunk of the document
+        prefix = f"{country}-{law_type}-{language}"
+        meta_base = {"country": country, "law_type": law_type, "language": language}
+        doc_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        # Until this content is fully ingested, answers must not be keyed to any version
+        self._document_hashes.pop(prefix, None)
+
+        # The index outlives the container: serve queries from it while re-ingesting
+        if not self.ready and await self._index_has_data(country, law_type, language):
+            self.ready = True
+            logger.info("Vector Search already holds the document, serving queries during ingestion")
+
+        if self._tok is None:
+            logger.error("Tokenizer not initialized, refusing to chunk the document")
+            return False
+
         try:
+            # Skip the whole document when exactly this content was fully ingested before
+            if await self.embedding_cache.get_document_hash(prefix) == doc_hash:
+                self.ready = True
+                self._document_hashes[prefix] = doc_hash
+                logger.info(f"Document {prefix} already ingested, skipping")
+                return True
+
             # Split into chunks
-            chunks = self._split_into_chunks(content)
-            logger.info(f"Split document into {len(chunks)} chunks")
+            windows = self._split_into_chunks(content)
+            logger.info(f"Split document into {len(windows)} chunks")
 
-            # Process chunks in batches
-            batch_size = 5  # Process 5 chunks at a time
-            total_batches = (len(chunks) + batch_size - 1) // batch_size
-            
-            for batch_idx in range(0, len(chunks), batch_size):
-                batch = chunks[batch_idx:batch_idx + batch_size]
-                logger.info(f"Processing batch {batch_idx//batch_size + 1} of {total_batches}")
-                
-                embeddings_data = []
-                for chunk_idx, chunk in enumerate(batch):
-                    try:
-                        # Generate embedding for chunk
-                        embedding = await self._generate_embedding(
-                            text=chunk,
-                            title=f"{country}-{law_type}-{language}",
-                            is_document=True
-                        )
-                        
-                        if embedding:
-                            embeddings_data.append({
-                                "id": f"{country}-{law_type}-{language}-{batch_idx+chunk_idx}",
-                                "embedding": embedding,
-                                "metadata": {
-                                    "country": country,
-                                    "law_type": law_type,
-                                    "language": language,
-                                    "text": chunk
-                                }
-                            })
-                    except Exception as e:
-                        logger.error(f"Error processing chunk {batch_idx+chunk_idx}: {str(e)}")
-                        continue
-
-                # Upload batch if we have any successful embeddings
-                if embeddings_data:
-                    success = await self._upload_embeddings(embeddings_data)
-                    if success:
-                        logger.info(f"Successfully uploaded batch {batch_idx//batch_size + 1}")
-                    else:
-                        logger.error(f"Failed to upload batch {batch_idx//batch_size + 1}")
-                
-                # Rate limiting
-                await asyncio.sleep(1)
+            # Chunks are identified by content hash, so unchanged chunks keep their id
+            # across reloads and only new ones need embedding and uploading
+            hashed: Dict[str, str] = {}
+            token_counts: Dict[str, int] = {}
+            for chunk, num_tokens in windows:
+                chunk_hash = self._chunk_hash(chunk)
+                hashed[chunk_hash] = chunk
+                token_counts[chunk_hash] = num_tokens
+            indexed = await self._get_indexed_hashes(prefix)
+            if indexed:
+                self.ready = True
+            else:
+                # Nothing recorded yet: datapoints may still exist under the positional
+                # ids ("{prefix}-{i}") of the original word chunker. Track them like any
+                # other stale chunk so they are removed, and retried until that succeeds
+                indexed = self._legacy_hashes(content)
+            hashes = [h for h in hashed if h not in indexed]
+            chunks = [hashed[h] for h in hashes]
+            logger.info(f"{len(hashed) - len(chunks)} chunks already indexed, {len(chunks)} to embed")
+
+            # Pack chunks into batches that fit a single embedding request
+            batches = self._pack_batches([token_counts[h] for h in hashes])
+            total_batches = len(batches)
+
+            # Vectors for the whole document, one row per chunk
+            vectors = np.empty((len(chunks), self.settings.DIMENSION_SIZE), dtype=np.float32)
+
+            # Embed several batches concurrently
+            semaphore = asyncio.Semaphore(self.settings.EMBEDDING_CONCURRENCY)
+            batch_rows = await asyncio.gather(*[
+                self._embed_batch(
+                    semaphore=semaphore,
+                    chunks=chunks,
+                    vectors=vectors,
+                    start=start,
+                    end=end,
+                    batch_num=batch_num,
+                    total_batches=total_batches,
+                    title=prefix
+                )
+                for batch_num, (start, end) in enumerate(batches, 1)
+            ])
+            rows = [row for embedded in batch_rows for row in embedded]
+            logger.info(f"Embedded {len(rows)} of {len(chunks)} chunks")
+
+            # Upload in large groups rather than once per embedding batch, several at a time
+            groups = [rows[i:i + UPSERT_BATCH_SIZE] for i in range(0, len(rows), UPSERT_BATCH_SIZE)]
+            upload_semaphore = asyncio.Semaphore(UPSERT_CONCURRENCY)
+
+            async def upload_group(group: List[int]) -> bool:
+                async with upload_semaphore:
+                    return await self._upload_embeddings(
+                        embeddings=vectors[group],
+                        ids=[f"{prefix}-{hashes[row]}" for row in group],
+                        metadata=[{**meta_base, "text": chunks[row]} for row in group]
+                    )
+
+            results = await asyncio.gather(*[upload_group(group) for group in groups])
+            uploaded = set()
+            for group_num, (group, success) in enumerate(zip(groups, results), 1):
+                if success:
+                    uploaded.update(hashes[row] for row in group)
+                    logger.info(f"Successfully uploaded group {group_num} of {len(groups)}")
+                else:
+                    logger.error(f"Failed to upload group {group_num} of {len(groups)}")
+
+            # Remove chunks that are no longer part of the document; they stay tracked
+            # until the removal succeeds so a later load retries it
+            stale = indexed.difference(hashed)
+            removed = True
+            if stale:
+                logger.info(f"Removing {len(stale)} chunks that are no longer in the document")
+                removed = await self._remove_datapoints([f"{prefix}-{h}" for h in stale])
+                if not removed:
+                    logger.error(f"Failed to remove {len(stale)} stale chunks, will retry on next load")
+            await self._set_indexed_hashes(prefix, (indexed - stale if removed else indexed) | uploaded)
 
+            # Context retrieved before this upload may be outdated
+            if uploaded or stale:
+                self._context_caches.clear()
+                self._context_lru.clear()
+                self.index_version += 1
+
+            # Remember the document only once the index holds exactly its chunks
+            if len(uploaded) == len(chunks) and removed:
+                await self.embedding_cache.set_document_hash(prefix, doc_hash)
+                self._document_hashes[prefix] = doc_hash
+
+            self.ready = True
+            if len(uploaded) < len(chunks) or not removed:
+                logger.warning(
+                    f"Document processing incomplete: {len(chunks) - len(uploaded)} chunks not uploaded, "
+                    f"{0 if removed else len(stale)} stale chunks not removed"
+                )
+                return False
             logger.info("Document processing complete")
             return True
 
@@ -106,7 +274,160 @@ class EmbeddingsManager:
             logger.error(f"Error in load_document: {str(e)}")
             return False
 
-    async def _generate_embedding(self, text: str, title: Optional[str] = None, is_document: bool = False) -> Optional[List[float]]:
+    def _legacy_hashes(self, content: str) -> Set[str]:
+        """Return the positional id suffixes the original word chunker used for this content."""
+        step = min(self.settings.CHUNK_SIZE, 500) - min(self.settings.CHUNK_OVERLAP, 50)
+        return {str(i) for i in range(len(range(0, len(content.split()), step)))}
+
+    def document_hash(self, country: str, law_type: str, language: str) -> Optional[str]:
+        """Return the SHA-256 of the document content fully ingested for a scope, if any."""
+        return self._document_hashes.get(f"{country}-{law_type}-{language}")
+
+    @staticmethod
+    def _chunk_hash(chunk: str) -> str:
+        """Return a short content hash identifying a chunk."""
+        return hashlib.blake2b(chunk.encode('utf-8'), digest_size=8).hexdigest()
+
+    async def _get_indexed_hashes(self, prefix: str) -> Set[str]:
+        """Return hashes of the chunks already uploaded for a document."""
+        indexed = self._indexed_hashes.get(prefix)
+        if indexed is None:
+            indexed = await self.embedding_cache.get_indexed(prefix)
+            self._indexed_hashes[prefix] = indexed
+        return set(indexed)
+
+    async def _set_indexed_hashes(self, prefix: str, hashes: Set[str]) -> None:
+        """Record hashes of the chunks uploaded for a document."""
+        self._indexed_hashes[prefix] = hashes
+        await self.embedding_cache.set_indexed(prefix, hashes)
+
+    async def _embed_batch(
+        self,
+        semaphore: asyncio.Semaphore,
+        chunks: List[str],
+        vectors: np.ndarray,
+        start: int,
+        end: int,
+        batch_num: int,
+        total_batches: int,
+        title: str
+    ) -> List[int]:
+        """
+        Embed a single batch of document chunks.
+        
+        Args:
+            semaphore: Limits the number of batches in flight
+            chunks: All text chunks of the document
+            vectors: Document embedding matrix, filled in for rows start:end
+            start: Index of the first chunk in this batch
+            end: Index past the last chunk in this batch
+            batch_num: 1-based batch number, for logging
+            total_batches: Total number of batches, for logging
+            title: Document title passed to the embedding model
+            
+        Returns:
+            List[int]: Rows of vectors that were successfully embedded
+        """
+        async with semaphore:
+            batch = chunks[start:end]
+            logger.info(f"Processing batch {batch_num} of {total_batches} ({len(batch)} chunks)")
+
+            # Small jitter so concurrent batches don't hit the API in lockstep
+            await asyncio.sleep(random.uniform(0, EMBED_JITTER))
+
+            embeddings = await self._generate_embeddings(
+                texts=batch,
+                title=title,
+                is_document=True
+            )
+
+            rows = []
+            for offset, embedding in enumerate(embeddings):
+                if embedding is None:
+                    logger.error(f"Error processing chunk {start + offset}: no embedding returned")
+                    continue
+
+                vectors[start + offset] = embedding
+                rows.append(start + offset)
+
+            return rows
+
+    def _pack_batches(self, token_counts: List[int]) -> List[Tuple[int, int]]:
+        """
+        Greedily pack texts into request-sized batches.
+        
+        Args:
+            token_counts: Token count of each text to embed
+            
+        Returns:
+            List[Tuple[int, int]]: (start, end) index ranges into the texts
+        """
+        batches = []
+        start = 0
+        tokens = 0
+        
+        for i, chunk_tokens in enumerate(token_counts):
+            if i > start and (i - start >= MAX_BATCH_INPUTS or tokens + chunk_tokens >= MAX_BATCH_TOKENS):
+                batches.append((start, i))
+                start = i
+                tokens = 0
+            tokens += chunk_tokens
+            
+        if start < len(token_counts):
+            batches.append((start, len(token_counts)))
+        return batches
+
+    async def embed_query(self, query: str) -> Optional[np.ndarray]:
+        """
+        Generate (or fetch from cache) the retrieval embedding for a user query.
+        
+        Args:
+            query: Query text
+            
+        Returns:
+            np.ndarray: float32 embedding vector or None if generation fails
+        """
+        if not self.embedding_model:
+            return None
+        embeddings = await self._generate_embeddings([query], is_document=False, count_stats=True)
+        return embeddings[0]
+
+    async def warmup(self, queries: Optional[List[str]] = None) -> None:
+        """
+        Open the embedding channel and precompute frequent queries ahead of real traffic.
+        
+        The in-process cache is first filled with the most recent persisted embeddings,
+        so repeat queries after a restart are served from memory. The channel probe
+        bypasses the caches on purpose: the point is to pay the gRPC channel setup and
+        TLS handshake once at startup instead of on a user's query.
+        
+        Args:
+            queries: Frequently asked questions to embed into the query cache
+        """
+        if not self.embedding_model:
+            return
+
+        recent = await self.embedding_cache.get_recent(self._emb_cache_max)
+        for key, values in recent:
+            self._cache_put(key, values)
+        if recent:
+            logger.info(f"Loaded {len(recent)} persisted embeddings into memory")
+
+        try:
+            await self.embedding_model.get_embeddings_async(
+                [TextEmbeddingInput(text="warmup", task_type="RETRIEVAL_QUERY")]
+            )
+            logger.info("Embedding channel warmed up")
+        except Exception as e:
+            logger.warning(f"Embedding warmup failed: {str(e)}")
+
+        if queries:
+            token_counts = [self._count_tokens(query) for query in queries]
+            for start, end in self._pack_batches(token_counts):
+                await self._generate_embeddings(queries[start:end], is_document=False)
+            logger.info(f"Precomputed embeddings for {len(queries)} frequent queries")
+
+    async def _generate_embedding(self, text: str, title: Optional[str] = None, is_document: bool = False) -> Optional[np.ndarray]:
         """
         Generate embedding for a piece of text.
         
@@ -116,37 +437,195 @@ class EmbeddingsManager:
             is_document: Whether this is a document (vs query)
             
         Returns:
-            List[float]: Embedding vector or None if generation fails
+            np.ndarray: L2-normalized float32 embedding vector or None if generation fails
         """
+        embeddings = await self._generate_embeddings([text], title=title, is_document=is_document)
+        return embeddings[0]
+
+    async def _generate_embeddings(
+        self,
+        texts: List[str],
+        title: Optional[str] = None,
+        is_document: bool = False,
+        count_stats: bool = False
+    ) -> List[Optional[np.ndarray]]:
+        """
+        Generate embeddings for several texts with a single API request.
+        
+        Cached texts are served from the in-process LRU cache, then the persistent
+        cache; only misses are sent to the model.
+        
+        Args:
+            texts: Texts to generate embeddings for
+            title: Optional title for document context
+            is_document: Whether these are documents (vs queries)
+            count_stats: Whether to record the lookups in the cache hit counters
+            
+        Returns:
+            List[Optional[np.ndarray]]: L2-normalized float32 embedding per input text,
+            None where generation failed
+        """
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+
         try:
             # Prepare input
             task_type = "RETRIEVAL_DOCUMENT" if is_document else "RETRIEVAL_QUERY"
+            title = title if is_document else None
+
+            # Serve from the in-process cache when possible; texts that share a key
+            # (duplicates, or whitespace/case variants) are looked up and embedded once
+            misses: Dict[bytes, List[int]] = {}
+            for i, text in enumerate(texts):
+                key = self._cache_key(text, task_type, title)
+                cached = self._emb_cache.get(key)
+                if cached is not None:
+                    self._emb_cache.move_to_end(key)
+                    results[i] = cached.astype(np.float32)
+                    if count_stats:
+                        self._cache_stats["hits"] += 1
+                else:
+                    misses.setdefault(key, []).append(i)
+
+            # Then from the persistent cache
+            if misses and self.embedding_cache.enabled:
+                persisted = await self.embedding_cache.get_many(list(misses))
+                for key, values in zip(list(misses), persisted):
+                    if values is not None:
+                        for i in misses.pop(key):
+                            results[i] = values
+                            if count_stats:
+                                self._cache_stats["persistent_hits"] += 1
+                        self._cache_put(key, values)
+
+            if not misses:
+                return results
+            if count_stats:
+                self._cache_stats["misses"] += sum(len(indices) for indices in misses.values())
+
+            inputs = [
+                TextEmbeddingInput(
+                    text=texts[indices[0]],
+                    task_type=task_type,
+                    title=title
+                )
+                for indices in misses.values()
+            ]
+
+            # Get embeddings
+            embeddings = await self._embed_inputs(inputs)
+            fresh = []
+            for (key, indices), embedding in zip(misses.items(), embeddings):
+                # Store unit vectors so similarity search is a plain dot product
+                values = np.asarray(embedding.values, dtype=np.float32)
+                values /= np.linalg.norm(values) + 1e-12
+                for i in indices:
+                    results[i] = values
+                self._cache_put(key, values)
+                fresh.append((key, values))
+
+            await self.embedding_cache.set_many(fresh)
+
+        except Exception as e:
+            logger.error(f"Error generating embeddings: {str(e)}")
+
+        return results
+
+    async def _embed_inputs(self, inputs: List[TextEmbeddingInput], attempt: int = 0) -> List[Any]:
+        """
+        Call the embedding model, backing off and halving the request while quota is exhausted.
+        
+        The backoff is shared by all requests: it doubles on every ResourceExhausted
+        and decays on every success, so requests only wait while the API pushes back.
+        Requests rejected as InvalidArgument (e.g. over the per-request token limit)
+        are halved and retried immediately.
+        
+        Args:
+            inputs: Prepared embedding inputs
+            attempt: Number of retries already made for these inputs
             
-            # Truncate if needed
-            if len(text.encode('utf-8')) > 8000:
-                text = text[:4000]  # Approximate size in bytes
-            
-            # Create embedding input
-            embedding_input = TextEmbeddingInput(
-                text=text,
-                task_type=task_type,
-                title=title if is_document else None
+        Returns:
+            List[Any]: Embedding responses in input order
+        """
+        try:
+            # The async prediction client keeps one HTTP/2 gRPC channel open for all requests
+            embeddings = await self.embedding_model.get_embeddings_async(inputs)
+        except InvalidArgument:
+            if len(inputs) == 1:
+                raise
+            mid = len(inputs) // 2
+            logger.warning(f"Embedding request of {len(inputs)} inputs rejected, retrying in halves")
+            return (
+                await self._embed_inputs(inputs[:mid], attempt)
+                + await self._embed_inputs(inputs[mid:], attempt)
             )
-            
-            # Get embedding
-            embeddings = self.embedding_model.get_embeddings([embedding_input])
-            return embeddings[0].values if embeddings else None
+        except ResourceExhausted:
+            if attempt >= MAX_EMBED_RETRIES:
+                raise
+            self._backoff = min(max(self._backoff * 2, MIN_BACKOFF), MAX_BACKOFF)
+            logger.warning(f"Embedding quota exhausted, backing off for {self._backoff:.1f}s")
+            await asyncio.sleep(self._backoff)
 
-        except Exception as e:
-            logger.error(f"Error generating embedding: {str(e)}")
-            return None
+            if len(inputs) == 1:
+                return await self._embed_inputs(inputs, attempt + 1)
+            mid = len(inputs) // 2
+            return (
+                await self._embed_inputs(inputs[:mid], attempt + 1)
+                + await self._embed_inputs(inputs[mid:], attempt + 1)
+            )
+
+        self._backoff *= 0.5
+        return embeddings
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report query embedding cache usage since startup.
+        
+        Returns:
+            Dict[str, Any]: Query lookup counters, query hit rate and in-memory cache size
+        """
+        total = sum(self._cache_stats.values())
+        hits = self._cache_stats["hits"] + self._cache_stats["persistent_hits"]
+        return {
+            **self._cache_stats,
+            "hit_rate": hits / total if total else 0.0,
+            "size": len(self._emb_cache),
+            "capacity": self._emb_cache_max
+        }
+
+    def _cache_key(self, text: str, task_type: str, title: Optional[str]) -> bytes:
+        """
+        Build the embedding cache key for a model/task/title/text combination.
+
+        Text is whitespace- and case-normalized so trivial variants share an entry.
+        """
+        normalized = " ".join(text.split()).lower()
+        raw = f"{self.settings.EMBEDDING_MODEL}\0{task_type}\0{title}\0{normalized}"
+        return hashlib.sha256(raw.encode('utf-8')).digest()
+
+    def _cache_put(self, key: bytes, values: np.ndarray) -> None:
+        """
+        Store an embedding in the LRU cache as float16, evicting the oldest entries.
+
+        Runs entirely on the event loop without awaiting, so no lock is needed.
+        """
+        self._emb_cache[key] = values.astype(np.float16)
+        self._emb_cache.move_to_end(key)
+        while len(self._emb_cache) > self._emb_cache_max:
+            self._emb_cache.popitem(last=False)
 
-    async def _upload_embeddings(self, embeddings_data: List[Dict[str, Any]]) -> bool:
+    async def _upload_embeddings(
+        self,
+        embeddings: np.ndarray,
+        ids: List[str],
+        metadata: List[Dict[str, Any]]
+    ) -> bool:
         """
         Upload embeddings to Vector Search.
         
         Args:
-            embeddings_data: List of embedding records to upload
+            embeddings: Embedding matrix, one row per datapoint
+            ids: Datapoint id per row
+            metadata: Metadata dict per row
             
         Returns:
             bool: Success status
@@ -156,12 +635,10 @@ class EmbeddingsManager:
             return False
 
         try:
-            embeddings = [d["embedding"] for d in embeddings_data]
-            ids = [d["id"] for d in embeddings_data]
-            metadata = [d["metadata"] for d in embeddings_data]
-
-            self.vector_search_client.upsert_embeddings(
-                embeddings=embeddings,
+            # Convert to lists only at the SDK boundary
+            await asyncio.to_thread(
+                self.vector_search_client.upsert_embeddings,
+                embeddings=embeddings.tolist(),
                 ids=ids,
                 metadata_dict=metadata
             )
@@ -171,6 +648,56 @@ class EmbeddingsManager:
             logger.error(f"Error uploading embeddings: {str(e)}")
             return False
 
+    async def _index_has_data(self, country: str, law_type: str, language: str) -> bool:
+        """Probe whether Vector Search already returns any datapoint for a scope."""
+        if not self.vector_search_client:
+            return False
+
+        try:
+            response = await asyncio.to_thread(
+                self.vector_search_client.find_neighbors,
+                embedding=self._dummy_embedding,
+                num_neighbors=1,
+                filter=self._search_filter(country, law_type, language)
+            )
+            return hasattr(response, 'neighbors') and len(response.neighbors) > 0
+        except Exception as e:
+            logger.warning(f"Failed to probe Vector Search: {str(e)}")
+            return False
+
+    async def _remove_datapoints(self, ids: List[str]) -> bool:
+        """
+        Remove datapoints from the index behind the Vector Search endpoint.
+        
+        Ids that are not in the index are ignored by the service.
+        
+        Args:
+            ids: Datapoint ids to remove
+            
+        Returns:
+            bool: Success status
+        """
+        if not self.vector_search_client:
+            logger.error("Vector Search client not initialized")
+            return False
+
+        try:
+            client = _get_index_client(self.settings.LOCATION)
+            for deployed_index in self.vector_search_client.deployed_indexes:
+                for i in range(0, len(ids), UPSERT_BATCH_SIZE):
+                    await asyncio.to_thread(
+                        client.remove_datapoints,
+                        request=RemoveDatapointsRequest(
+                            index=deployed_index.index,
+                            datapoint_ids=ids[i:i + UPSERT_BATCH_SIZE]
+                        )
+                    )
+            return True
+
+        except Exception as e:
+            logger.error(f"Error removing datapoints: {str(e)}")
+            return False
+
     async def get_relevant_context(
         self,
         query: str,
@@ -196,53 +723,108 @@ class EmbeddingsManager:
             logger.warning("Services not fully initialized")
             return []
 
+        if not self.ready:
+            logger.warning("Document ingestion still in progress")
+            return []
+
         try:
+            # Exact repeats skip embedding and the similarity scan altogether
+            exact_key = (" ".join(query.split()).lower(), country, law_type, language, top_k)
+            cached = self._context_lru.get(exact_key)
+            if cached is not None:
+                self._context_lru.move_to_end(exact_key)
+                return list(cached)
+
             # Generate query embedding
             query_embedding = await self._generate_embedding(
                 text=query,
                 is_document=False
             )
             
-            if not query_embedding:
+            if query_embedding is None:
                 logger.error("Failed to generate query embedding")
                 return []
 
-            # Search for similar vectors
-            response = self.vector_search_client.find_neighbors(
-                embedding=query_embedding,
+            # Reuse the context retrieved for a near-identical earlier query
+            scope = (country, law_type, language, top_k)
+            context_cache = self._context_caches.get(scope)
+            if context_cache is None:
+                context_cache = self._context_caches[scope] = SemanticCache(
+                    capacity=self.settings.CONTEXT_CACHE_SIZE,
+                    threshold=self.settings.CONTEXT_CACHE_THRESHOLD
+                )
+            cached = context_cache.lookup(query_embedding)
+            if cached is not None:
+                self._context_lru_put(exact_key, cached)
+                return list(cached)
+
+            # Search for similar vectors without blocking the event loop
+            response = await asyncio.to_thread(
+                self.vector_search_client.find_neighbors,
+                embedding=query_embedding.tolist(),
                 num_neighbors=top_k,
-                filter=f"country = '{country}' AND law_type = '{law_type}' AND language = '{language}'"
+                filter=self._search_filter(country, law_type, language)
             )
 
             # Extract and return relevant text chunks
             if response and hasattr(response, 'neighbors'):
-                return [n.metadata["text"] for n in response.neighbors]
+                chunks = [n.metadata["text"] for n in response.neighbors]
+                if chunks:
+                    context_cache.add(query_embedding, tuple(chunks))
+                    self._context_lru_put(exact_key, tuple(chunks))
+                return chunks
             return []
 
         except Exception as e:
             logger.error(f"Error in get_relevant_context: {str(e)}")
             return []
 
-    def _split_into_chunks(self, text: str) -> List[str]:
+    def _context_lru_put(self, key: Tuple[str, str, str, str, int], chunks: Tuple[str, ...]) -> None:
+        """Store retrieved chunks for an exact query, evicting the least recently used."""
+        self._context_lru[key] = chunks
+        self._context_lru.move_to_end(key)
+        while len(self._context_lru) > self.settings.CONTEXT_CACHE_SIZE:
+            self._context_lru.popitem(last=False)
+
+    def _search_filter(self, country: str, law_type: str, language: str) -> str:
+        """Return the Vector Search filter for a scope, building it once per scope."""
+        scope = (country, law_type, language)
+        search_filter = self._filter_cache.get(scope)
+        if search_filter is None:
+            search_filter = f"country = '{country}' AND law_type = '{law_type}' AND language = '{language}'"
+            self._filter_cache[scope] = search_filter
+        return search_filter
+
+    def _count_tokens(self, text: str) -> int:
+        """Count tokens, assuming one per character when no tokenizer is available."""
+        if self._tok is None:
+            return len(text)
+        return len(self._tok.encode(text, disallowed_special=()))
+
+    def _split_into_chunks(self, text: str) -> List[Tuple[str, int]]:
         """
-        Split text into manageable chunks.
+        Split text into overlapping windows of tokens.
         
         Args:
             text: Text to split
             
         Returns:
-            List[str]: List of text chunks
+            List[Tuple[str, int]]: Text chunks with the token count of their window
         """
-        words = text.split()
+        ids = self._tok.encode(text, disallowed_special=())
         chunks = []
         
-        # Use smaller chunks to ensure we stay under token limits
-        chunk_size = min(self.settings.CHUNK_SIZE, 500)  # words per chunk
-        overlap = min(self.settings.CHUNK_OVERLAP, 50)   # words overlap
+        # Keep chunks well under the embedding model's input limit
+        chunk_size = min(self.settings.CHUNK_SIZE, 500)  # tokens per chunk
+        overlap = min(self.settings.CHUNK_OVERLAP, 50)   # tokens overlap
         
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = " ".join(words[i:i + chunk_size])
-            chunks.append(chunk)
+        for i in range(0, len(ids), chunk_size - overlap):
+            # Windows may cut through a multi-byte character; drop the partial bytes
+            window = ids[i:i + chunk_size]
+            raw = self._tok.decode_bytes(window)
+            chunk = raw.decode('utf-8', errors='ignore').strip()
+            if chunk:
+                chunks.append((chunk, len(window)))
             
         return chunks
 
@@ -261,17 +843,17 @@ class EmbeddingsManager:
                 },
                 "vector_search": {
                     "initialized": self.vector_search_client is not None,
-                    "endpoint": self.settings.VECTOR_SEARCH_ENDPOINT
+                    "endpoint": self.settings.VECTOR_SEARCH_ENDPOINT,
+                    "ready": self.ready
                 }
             }
 
             # Test vector search if initialized
             if self.vector_search_client:
                 try:
-                    # Create a dummy embedding for testing
-                    dummy_embedding = [0.0] * self.settings.DIMENSION_SIZE
-                    response = self.vector_search_client.find_neighbors(
-                        embedding=dummy_embedding,
+                    response = await asyncio.to_thread(
+                        self.vector_search_client.find_neighbors,
+                        embedding=self._dummy_embedding,
                         num_neighbors=1
                     )
                     status["vector_search"]["operational"] = True
@@ -290,4 +872,14 @@ class EmbeddingsManager:
                 "status": "error",
                 "message": str(e),
                 "endpoint": self.settings.VECTOR_SEARCH_ENDPOINT
-            }
\ No newline at end of file
+            }
+
+    async def close(self) -> None:
+        """Release connections held by the manager."""
+        await self.embedding_cache.close()
+
+
+@lru_cache
+def get_embeddings_manager() -> EmbeddingsManager:
+    """Return the process-wide EmbeddingsManager, creating it on first use."""
+    return EmbeddingsManager(get_settings())
\ No newline at end of file
@@ -0,0 +1,77 @@
+from typing import Any, List, Optional
+import numpy as np
+
+# Rows allocated on first insert; the matrix doubles from here up to capacity
+INITIAL_ROWS = 64
+
+class SemanticCache:
+    def __init__(self, capacity: int, threshold: float):
+        """
+        Cache values by embedding similarity rather than exact key.
+
+        Args:
+            capacity: Maximum number of entries; the oldest entry is evicted first
+            threshold: Minimum cosine similarity for a lookup to count as a hit
+        """
+        self.capacity = capacity
+        self.threshold = threshold
+        # Unit-norm keys, one per row; rows [0, size) are valid
+        self._matrix: Optional[np.ndarray] = None
+        self._values: List[Any] = []
+        self._size = 0
+        self._next = 0  # Row written by the next insert
+
+    def __len__(self) -> int:
+        return self._size
+
+    def lookup(self, embedding: np.ndarray) -> Optional[Any]:
+        """
+        Find the value stored under the most similar embedding.
+
+        Args:
+            embedding: Query embedding
+
+        Returns:
+            Any: Cached value if its similarity reaches the threshold, else None
+        """
+        if not self._size:
+            return None
+
+        # Rows are normalized on insert, so cosine similarity is a single gemv
+        sims = self._matrix[:self._size] @ self._normalize(embedding)
+        best = int(sims.argmax())
+        if sims[best] >= self.threshold:
+            return self._values[best]
+        return None
+
+    def add(self, embedding: np.ndarray, value: Any) -> None:
+        """
+        Store a value under an embedding.
+
+        Args:
+            embedding: Key embedding
+            value: Value to cache
+        """
+        vec = self._normalize(embedding)
+
+        if self._matrix is None:
+            self._matrix = np.empty((min(INITIAL_ROWS, self.capacity), vec.shape[0]), dtype=np.float32)
+        elif self._next == len(self._matrix) and len(self._matrix) < self.capacity:
+            grown = np.empty((min(len(self._matrix) * 2, self.capacity), vec.shape[0]), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+
+        self._matrix[self._next] = vec
+        if self._next < len(self._values):
+            self._values[self._next] = value
+        else:
+            self._values.append(value)
+
+        # Once full, wrap around and overwrite the oldest entry
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        return vec / (np.linalg.norm(vec) + 1e-12)
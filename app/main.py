@@ -1,12 +1,16 @@
 from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 import asyncio
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 from google.cloud import logging as cloud_logging
 import logging
 from .core.config import settings
-from .core.embeddings import EmbeddingsManager
-from .services.gemini import GeminiService
+from .core.embeddings import get_embeddings_manager
+from .services.gemini import get_gemini_service
 from .bot.handlers import BotHandlers
 
 # Setup logging
@@ -15,51 +19,94 @@ cloud_client.setup_logging()
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Nomads Laws")
+WEBHOOK_URL = f"https://{settings.CLOUD_RUN_URL}/telegram-webhook"
+LAW_DOCUMENT_PATH = "app/data/georgia/tax/ru/law.txt"
+FAQ_QUERIES_PATH = "app/data/faq_queries.txt"
+
+app = FastAPI(title="Nomads Laws", default_response_class=ORJSONResponse)
 
 # Initialize services
-embeddings_manager = EmbeddingsManager(settings)
-gemini_service = GeminiService(embeddings_manager)
+embeddings_manager = get_embeddings_manager()
+gemini_service = get_gemini_service()
 bot_handlers = BotHandlers(gemini_service)
 
 # Initialize Telegram application
-telegram_app = Application.builder().token(settings.TELEGRAM_TOKEN).build()
+telegram_app = (
+    Application.builder()
+    .token(settings.TELEGRAM_TOKEN)
+    .connection_pool_size(settings.TELEGRAM_CONNECTION_POOL_SIZE)
+    .pool_timeout(settings.TELEGRAM_POOL_TIMEOUT)
+    .get_updates_connection_pool_size(settings.TELEGRAM_UPDATES_POOL_SIZE)
+    .build()
+)
 telegram_app.add_handler(CommandHandler("start", bot_handlers.start))
 telegram_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot_handlers.handle_message))
 
+async def load_faq_queries():
+    try:
+        content = await asyncio.to_thread(Path(FAQ_QUERIES_PATH).read_text, encoding='utf-8')
+        return [line.strip() for line in content.splitlines() if line.strip()]
+    except Exception as e:
+        logger.warning(f"Failed to read FAQ queries: {str(e)}")
+        return []
+
+async def load_default_document():
+    # Until this finishes, questions get a "still loading" answer rather than "not found"
+    embeddings_manager.loading = True
+    try:
+        # Restore the persistent cache snapshot off the import path, before anything reads it
+        await embeddings_manager.embedding_cache.open()
+
+        # Cheap compared to ingestion, so do it first: early questions hit a warm cache
+        await embeddings_manager.warmup(await load_faq_queries())
+
+        # Read in a worker thread so the event loop keeps serving requests
+        content = await asyncio.to_thread(Path(LAW_DOCUMENT_PATH).read_text, encoding='utf-8')
+        logger.info(f"Loaded tax law document: {len(content)} characters")
+        
+        success = await embeddings_manager.load_document(
+            content=content,
+            country=settings.DEFAULT_COUNTRY,
+            law_type=settings.DEFAULT_LAW_TYPE,
+            language=settings.DEFAULT_LANGUAGE
+        )
+        if success:
+            logger.info("Document processing complete")
+        else:
+            logger.warning("Document processing completed with errors")
+
+        # Persist what ingestion embedded now rather than relying on shutdown
+        await embeddings_manager.embedding_cache.save_snapshot()
+    except Exception as e:
+        logger.error(f"Failed to process document: {str(e)}")
+    finally:
+        embeddings_manager.loading = False
+
+async def snapshot_embedding_cache():
+    # Periodically persist embeddings of user queries; shutdown leaves no time for it
+    while True:
+        await asyncio.sleep(settings.EMBEDDING_CACHE_SNAPSHOT_INTERVAL)
+        await embeddings_manager.embedding_cache.save_snapshot()
+
 @app.on_event("startup")
 async def startup_event():
     try:
         logger.info("Starting application...")
+
+        # Blocking SDK calls run in the default executor; size it for concurrent I/O
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=settings.THREAD_POOL_SIZE)
+        )
         
-        # Load document
-        try:
-            with open("app/data/georgia/tax/ru/law.txt", 'r', encoding='utf-8') as f:
-                content = f.read()
-                logger.info(f"Loaded tax law document: {len(content)} characters")
-            
-            success = await embeddings_manager.load_document(
-                content=content,
-                country=settings.DEFAULT_COUNTRY,
-                law_type=settings.DEFAULT_LAW_TYPE,
-                language=settings.DEFAULT_LANGUAGE
-            )
-            if success:
-                logger.info("Document processing complete")
-            else:
-                logger.warning("Document processing completed with errors")
-        except Exception as e:
-            logger.error(f"Failed to process document: {str(e)}")
-            # Continue startup even if document processing fails
+        # Load document in the background so the service can take webhooks meanwhile
+        app.state.ingestion_task = asyncio.create_task(load_default_document())
+        app.state.snapshot_task = asyncio.create_task(snapshot_embedding_cache())
         
         # Setup and verify webhook
-        webhook_url = f"https://{settings.CLOUD_RUN_URL}/telegram-webhook"
-        
-        # Get current webhook info
         webhook_info = await telegram_app.bot.get_webhook_info()
         current_url = webhook_info.url
 
-        if current_url != webhook_url:
+        if current_url != WEBHOOK_URL:
             # Delete old webhook if exists
             if current_url:
                 await telegram_app.bot.delete_webhook()
@@ -67,26 +114,41 @@ async def startup_event():
 
             # Set new webhook
             await telegram_app.bot.set_webhook(
-                url=webhook_url,
+                url=WEBHOOK_URL,
                 allowed_updates=['message', 'callback_query'],
                 drop_pending_updates=True
             )
-            logger.info(f"Set webhook URL to: {webhook_url}")
+            logger.info(f"Set webhook URL to: {WEBHOOK_URL}")
         else:
-            logger.info(f"Webhook already set to correct URL: {webhook_url}")
+            logger.info(f"Webhook already set to correct URL: {WEBHOOK_URL}")
 
     except Exception as e:
         logger.error(f"Startup error: {str(e)}")
         # Don't raise exception to allow partial functionality
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    try:
+        for name in ("ingestion_task", "snapshot_task"):
+            task = getattr(app.state, name, None)
+            if task and not task.done():
+                task.cancel()
+        # Answer messages that were acknowledged but not yet processed
+        await bot_handlers.drain(settings.SHUTDOWN_DRAIN_TIMEOUT)
+        await embeddings_manager.close()
+    except Exception as e:
+        logger.error(f"Shutdown error: {str(e)}")
+
 @app.post("/telegram-webhook")
 async def telegram_webhook(request: Request):
     """Handle Telegram webhook requests"""
     try:
-        update_data = await request.json()
+        update_data = orjson.loads(await request.body())
         logger.info(f"Received webhook update: {update_data.get('update_id')}")
         
         update = Update.de_json(update_data, telegram_app.bot)
+        # Message handlers only queue work, so this returns quickly; awaiting it keeps
+        # Telegram's retry for updates that fail before they are queued
         await telegram_app.process_update(update)
         
         return {"status": "ok"}
@@ -97,15 +159,23 @@ async def telegram_webhook(request: Request):
 @app.get("/health")
 async def health_check():
     try:
-        webhook_info = await telegram_app.bot.get_webhook_info()
-        webhook_status = {
-            "url": webhook_info.url,
-            "pending_updates": webhook_info.pending_update_count,
-            "last_error": webhook_info.last_error_date,
-            "last_error_message": webhook_info.last_error_message
-        }
-        
-        vector_status = await embeddings_manager.check_status()
+        # Independent round-trips; one failing must not hide the other's status
+        webhook_info, vector_status = await asyncio.gather(
+            telegram_app.bot.get_webhook_info(),
+            embeddings_manager.check_status(),
+            return_exceptions=True
+        )
+        if isinstance(webhook_info, Exception):
+            webhook_status = {"error": str(webhook_info)}
+        else:
+            webhook_status = {
+                "url": webhook_info.url,
+                "pending_updates": webhook_info.pending_update_count,
+                "last_error": webhook_info.last_error_date,
+                "last_error_message": webhook_info.last_error_message
+            }
+        if isinstance(vector_status, Exception):
+            vector_status = {"status": "error", "message": str(vector_status)}
         
         return {
             "status": "healthy",
@@ -119,9 +189,15 @@ async def health_check():
 @app.get("/debug")
 async def debug_info():
     """Endpoint to check system status"""
+    vector_status, webhook_info = await asyncio.gather(
+        embeddings_manager.check_status(),
+        telegram_app.bot.get_webhook_info(),
+        return_exceptions=True
+    )
     return {
-        "vector_search_status": await embeddings_manager.check_status(),
-        "webhook_info": await telegram_app.bot.get_webhook_info(),
+        "vector_search_status": vector_status if not isinstance(vector_status, Exception) else str(vector_status),
+        "webhook_info": webhook_info if not isinstance(webhook_info, Exception) else str(webhook_info),
+        "embedding_cache": embeddings_manager.stats(),
         "settings": {
             "endpoint": settings.VECTOR_SEARCH_ENDPOINT,
             "model": settings.EMBEDDING_MODEL,
@@ -1,18 +1,86 @@
 import google.generativeai as genai
+import asyncio
+import hashlib
 import logging
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Optional, Tuple
 from ..core.config import settings
+from ..core.embeddings import get_embeddings_manager
+from ..core.semantic_cache import SemanticCache
 
 logger = logging.getLogger(__name__)
 
+NO_CONTEXT_ANSWER = "Извините, я не нашел релевантной информации в законодательстве по вашему вопросу."
+ERROR_ANSWER = "Извините, произошла ошибка при обработке вашего вопроса. Попробуйте позже."
+LOADING_ANSWER = "База законодательства еще загружается. Пожалуйста, повторите вопрос через несколько минут."
+# Minimum growth of a streamed answer, and time since the last push, before the
+# partial text is pushed again; Telegram rate-limits message edits per chat
+STREAM_UPDATE_CHARS = 200
+STREAM_UPDATE_INTERVAL = 1.0  # seconds
+GENERATION_MODEL = "gemini-1.5-pro"
+# Part of the shared answer cache key; bump whenever the prompt changes
+PROMPT_VERSION = 2
+
 class GeminiService:
     def __init__(self, embeddings_manager):
         genai.configure(api_key=settings.GOOGLE_API_KEY)
-        self.model = genai.GenerativeModel("gemini-1.5-pro")
+        self.model = genai.GenerativeModel(GENERATION_MODEL)
         self.embeddings_manager = embeddings_manager
+        # Answers to previous questions per (country, law_type, language), looked up by
+        # question embedding similarity
+        self._answer_caches: Dict[Tuple[str, str, str], SemanticCache] = {}
+        # Index version the answer caches were filled against
+        self._index_version = embeddings_manager.index_version
+        # Static part of the prompt per (country, law_type, language)
+        self._prompt_prefixes: Dict[Tuple[str, str, str], str] = {}
         
     async def ask_legal_question(self, question: str, country: str = settings.DEFAULT_COUNTRY,
-                               law_type: str = settings.DEFAULT_LAW_TYPE, language: str = settings.DEFAULT_LANGUAGE) -> str:
+                               law_type: str = settings.DEFAULT_LAW_TYPE, language: str = settings.DEFAULT_LANGUAGE,
+                               on_partial: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+        """
+        Answer a question from the relevant sections of law.
+        
+        When on_partial is given the answer is streamed, and the callback receives
+        the text generated so far every STREAM_UPDATE_CHARS characters, at most once
+        per STREAM_UPDATE_INTERVAL.
+        """
         try:
+            # Only while ingestion is running; if it ended without an index the
+            # normal path below answers NO_CONTEXT_ANSWER instead of "loading" forever
+            if not self.embeddings_manager.ready and self.embeddings_manager.loading:
+                return LOADING_ANSWER
+
+            # Answers given before the index changed may be outdated
+            if self._index_version != self.embeddings_manager.index_version:
+                self._answer_caches.clear()
+                self._index_version = self.embeddings_manager.index_version
+
+            # Reuse the answer to a near-identical earlier question when possible
+            answer_cache = self._answer_caches.get((country, law_type, language))
+            if answer_cache is None:
+                answer_cache = self._answer_caches[(country, law_type, language)] = SemanticCache(
+                    capacity=settings.SEMANTIC_CACHE_SIZE,
+                    threshold=settings.SEMANTIC_CACHE_THRESHOLD
+                )
+            question_embedding = await self.embeddings_manager.embed_query(question)
+            if question_embedding is not None:
+                answer = answer_cache.lookup(question_embedding)
+                if answer is not None:
+                    logger.info("Semantic cache hit")
+                    return answer
+
+            # Then an exact repeat answered by any instance for the same document version
+            doc_hash = self.embeddings_manager.document_hash(country, law_type, language)
+            answer_key = None
+            if doc_hash is not None:
+                answer_key = self._answer_key(question, country, law_type, language, doc_hash)
+                answer = await self.embeddings_manager.embedding_cache.get_answer(answer_key)
+                if answer is not None:
+                    logger.info("Shared answer cache hit")
+                    if question_embedding is not None:
+                        answer_cache.add(question_embedding, answer)
+                    return answer
+
             relevant_chunks = await self.embeddings_manager.get_relevant_context(
                 query=question,
                 country=country,
@@ -21,21 +89,65 @@ class GeminiService:
             )
             
             if not relevant_chunks:
-                return "Извините, я не нашел релевантной информации в законодательстве по вашему вопросу."
+                return NO_CONTEXT_ANSWER
 
             context = "\n\n".join(relevant_chunks)
-            
-            prompt = f"""You are a Legal Assistant specializing in {country.title()} {law_type} law.
-            Answer the following question in {language}.
-            Base your answer only on these relevant sections of law:
-            
-            {context}
-            
-            Question: {question}"""
+            prompt = self._prompt_prefix(country, law_type, language) + context + "\n\nQuestion: " + question
+
+            if on_partial is None:
+                response = await self.model.generate_content_async(prompt)
+                answer = response.text
+            else:
+                answer = await self._stream_answer(prompt, on_partial)
 
-            response = self.model.generate_content(prompt)
-            return response.text
+            if question_embedding is not None:
+                answer_cache.add(question_embedding, answer)
+            if answer_key is not None:
+                await self.embeddings_manager.embedding_cache.set_answer(answer_key, answer, settings.ANSWER_CACHE_TTL)
+            return answer
 
         except Exception as e:
             logger.error(f"Error in ask_legal_question: {str(e)}")
-            return "Извините, произошла ошибка при обработке вашего вопроса. Попробуйте позже."
\ No newline at end of file
+            return ERROR_ANSWER
+
+    async def _stream_answer(self, prompt: str, on_partial: Callable[[str], Awaitable[None]]) -> str:
+        response = await self.model.generate_content_async(prompt, stream=True)
+        loop = asyncio.get_running_loop()
+        answer = ""
+        shown = 0
+        shown_at = loop.time()
+        async for chunk in response:
+            answer += chunk.text
+            if len(answer) - shown >= STREAM_UPDATE_CHARS and loop.time() - shown_at >= STREAM_UPDATE_INTERVAL:
+                shown = len(answer)
+                shown_at = loop.time()
+                try:
+                    await on_partial(answer)
+                except Exception as e:
+                    # A failed preview must not lose the answer itself
+                    logger.warning(f"Failed to deliver partial answer: {str(e)}")
+        return answer
+
+    @staticmethod
+    def _answer_key(question: str, country: str, law_type: str, language: str, doc_hash: str) -> bytes:
+        # Answers change with the document, the model and the prompt, so all are part of the key
+        normalized = " ".join(question.split()).lower()
+        raw = f"{GENERATION_MODEL}\0{PROMPT_VERSION}\0{doc_hash}\0{country}\0{law_type}\0{language}\0{normalized}"
+        return hashlib.sha256(raw.encode('utf-8')).digest()
+
+    def _prompt_prefix(self, country: str, law_type: str, language: str) -> str:
+        key = (country, law_type, language)
+        prefix = self._prompt_prefixes.get(key)
+        if prefix is None:
+            prefix = self._prompt_prefixes[key] = (
+                f"You are a Legal Assistant specializing in {country.title()} {law_type} law.\n"
+                f"Answer the following question in {language}.\n"
+                "Base your answer only on these relevant sections of law:\n\n"
+            )
+        return prefix
+
+
+@lru_cache
+def get_gemini_service() -> GeminiService:
+    """Return the process-wide GeminiService, creating it on first use."""
+    return GeminiService(get_embeddings_manager())
\ No newline at end of file
@@ -2,4 +2,5 @@ from app.main import app
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+    # loop="auto" picks uvloop when it is installed and falls back to asyncio otherwise
+    uvicorn.run(app, host="0.0.0.0", port=8080, loop="auto")
\ No newline at end of file